@@ -1,11 +1,13 @@
 import os
 import logging
 import datetime
-import pytz
-from flask import Blueprint, request, render_template_string
+import orjson
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Blueprint, request, render_template, current_app
 from google import genai
 from google.cloud import firestore
 from main import celery_app
+from timezone_utils import WIB_TZ
 
 # Import all necessary clients and health checks from other modules
 from dependencies import db, storage_client, redis_client, GCS_BUCKET_NAME, ACTIVE_GEMINI_KEYS
@@ -17,6 +19,15 @@ from .core import health_check as core_health_check
 
 admin_bp = Blueprint('admin_bp', __name__)
 
+# A hung probe is reported as an error instead of holding up the whole page
+HEALTH_CHECK_TIMEOUT = 5
+# Shared by every poller so monitors don't multiply load on the probed services
+HEALTH_CHECK_CACHE_KEY = "admin:health_checks"
+HEALTH_CHECK_CACHE_TTL = 15
+# Probes get their own small pool: a timed-out probe keeps its thread until the
+# dependency answers, and that must not starve request-path work on io_executor
+_health_check_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='health')
+
 # --- Health Check Functions (External Services) ---
 def check_redis():
     redis_conn = redis_client()
@@ -25,12 +36,16 @@ def check_redis():
         redis_conn.ping(); return {"status": "OK", "details": "Ping successful."}
     except Exception as e: return {"status": "ERROR", "details": f"Failed to ping Redis server: {str(e)}"}
 
+_gemini_client = None
+
 def check_gemini_api():
+    global _gemini_client
     if not ACTIVE_GEMINI_KEYS: return {"status": "ERROR", "details": "No GEMINI_API_KEY variables found."}
     try:
-        genai.configure(api_key=ACTIVE_GEMINI_KEYS[0])
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        model.count_tokens("test")
+        # One client per process; a model metadata lookup authenticates the key without a billable call
+        if _gemini_client is None:
+            _gemini_client = genai.Client(api_key=ACTIVE_GEMINI_KEYS[0])
+        _gemini_client.models.get(model='gemini-2.5-flash')
         return {"status": "OK", "details": "Successfully authenticated with Gemini API."}
     except Exception as e: return {"status": "ERROR", "details": f"Gemini API key 1 may be invalid or quota exceeded: {str(e)}"}
 
@@ -42,6 +57,51 @@ def check_celery():
         return {"status": "OK", "details": f"Found {len(active_workers)} active worker(s): {', '.join(active_workers.keys())}"}
     except Exception as e: return {"status": "ERROR", "details": f"Could not connect to Celery broker (Redis). Error: {str(e)}"}
 
+def run_health_checks(checks):
+    """
+    Runs independent health checks concurrently on the dedicated health-check pool.
+    Total wall time is bounded by HEALTH_CHECK_TIMEOUT rather than the sum of all probes.
+    """
+    futures = {name: _health_check_executor.submit(check) for name, check in checks.items()}
+    done, _ = wait(futures.values(), timeout=HEALTH_CHECK_TIMEOUT)
+    results = {}
+    for name, future in futures.items():
+        if future not in done:
+            results[name] = {"status": "ERROR", "details": f"Health check timed out after {HEALTH_CHECK_TIMEOUT}s."}
+        elif future.exception():
+            results[name] = {"status": "ERROR", "details": f"Health check raised an error: {future.exception()}"}
+        else:
+            results[name] = future.result()
+    return results
+
+def get_health_check_results(checks):
+    """
+    Returns (results, cache_status) for the given checks, serving results from Redis
+    for HEALTH_CHECK_CACHE_TTL seconds after each real probe run.
+    """
+    redis_conn = redis_client()
+    redis_reachable = False
+    if redis_conn:
+        try:
+            cached = redis_conn.get(HEALTH_CHECK_CACHE_KEY)
+            if cached:
+                return orjson.loads(cached), "HIT"
+            redis_reachable = True
+        except Exception as e:
+            logging.warning(f"Admin health check cache read failed: {e}")
+
+    # The cache read above already round-tripped to Redis, so it stands in for a separate PING
+    redis_check_names = [name for name, check in checks.items() if check is check_redis] if redis_reachable else []
+    results = run_health_checks({name: check for name, check in checks.items() if name not in redis_check_names})
+    for name in redis_check_names:
+        results[name] = {"status": "OK", "details": "Health check cache read successful."}
+    if redis_conn:
+        try:
+            redis_conn.set(HEALTH_CHECK_CACHE_KEY, orjson.dumps(results), ex=HEALTH_CHECK_CACHE_TTL)
+        except Exception as e:
+            logging.warning(f"Admin health check cache write failed: {e}")
+    return results, "MISS"
+
 # --- Data Fetching Functions for Dashboard ---
 def get_all_challenges_data():
     """
@@ -182,6 +242,14 @@ ADMIN_PAGE_TEMPLATE = """
 </body>
 </html>
 """
+_admin_page_template = None
+
+def get_admin_page_template():
+    """Compiles ADMIN_PAGE_TEMPLATE once with the app's Jinja environment; render_template_string recompiles it on every call."""
+    global _admin_page_template
+    if _admin_page_template is None:
+        _admin_page_template = current_app.jinja_env.from_string(ADMIN_PAGE_TEMPLATE)
+    return _admin_page_template
 
 # --- Main Admin Endpoint ---
 @admin_bp.route('/admin')
@@ -191,31 +259,35 @@ def system_admin_dashboard():
     if not ADMIN_SECRET_KEY or secret != ADMIN_SECRET_KEY:
         return "Unauthorized", 401
 
-    internal_module_checks = {
-        "Authentication": auth_health_check(),
-        "Onboarding": onboarding_health_check(),
-        "Social": social_health_check(),
-        "Gamification": gamification_health_check(),
-        "Core Upload": core_health_check(),
+    internal_checks = {
+        "Authentication": auth_health_check,
+        "Onboarding": onboarding_health_check,
+        "Social": social_health_check,
+        "Gamification": gamification_health_check,
+        "Core Upload": core_health_check,
     }
-
-    external_service_checks = {
-        "Redis Cache": check_redis(),
-        "Celery Workers": check_celery(),
-        "Gemini AI API": check_gemini_api(),
+    external_checks = {
+        "Redis Cache": check_redis,
+        "Celery Workers": check_celery,
+        "Gemini AI API": check_gemini_api,
     }
 
+    # All probes run at once; results are split back into the two dashboard sections
+    check_results, cache_status = get_health_check_results({**internal_checks, **external_checks})
+    internal_module_checks = {name: check_results[name] for name in internal_checks}
+    external_service_checks = {name: check_results[name] for name in external_checks}
+
     # Fetch live data using the new categorized function
     categorized_challenges = get_all_challenges_data()
     live_leaderboard = get_leaderboard_data()
 
-    timestamp = datetime.datetime.now(pytz.timezone('Asia/Jakarta')).strftime('%Y-%m-%d %H:%M:%S %Z')
+    timestamp = datetime.datetime.now(WIB_TZ).strftime('%Y-%m-%d %H:%M:%S %Z')
     
-    return render_template_string(
-        ADMIN_PAGE_TEMPLATE, 
+    return render_template(
+        get_admin_page_template(),
         internal_checks=internal_module_checks,
         external_checks=external_service_checks,
         challenges=categorized_challenges, # Pass the categorized dictionary
         leaderboard=live_leaderboard,
         timestamp=timestamp
-    )
\ No newline at end of file
+    ), 200, {'X-Cache': cache_status}
\ No newline at end of file
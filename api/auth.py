@@ -17,6 +17,7 @@ from .email_utils import send_verification_email
 from .pydantic_models import AuthRequest, VerifyRequest, GoogleAuthRequest, ResendCodeRequest
 from .config import db, JWT_SECRET_KEYS, ANDROID_CLIENT_ID
 from .sanitization import sanitize_email, sanitize_string, sanitize_username
+from .cache_utils import invalidate_fcm_token_cache
 from extensions import limiter # <-- IMPORT the limiter instance
 from tasks import sync_user_to_algolia_task
 auth_bp = Blueprint('auth_bp', __name__)
@@ -185,6 +186,8 @@ def login():
     if not check_password_hash(user_data.get('passwordHash', ''), sanitized_password):
         return jsonify({"error_code": "UNAUTHORIZED"}), 401
     if not user_data.get('isVerified'): return jsonify({"error_code": "NOT_VERIFIED"}), 403
+    # A fresh login usually means a new device token is about to be registered
+    invalidate_fcm_token_cache(user_data['userId'])
     
     token = jwt.encode({
         'user_id': user_data['userId'], 'email': sanitized_email,
@@ -232,6 +235,9 @@ def auth_google():
         db.collection('referral_codes').document(referral_code).set({'userId': google_id})
         email_hash = hashlib.sha256(user_email.encode('utf-8')).hexdigest()
         db.collection('email_hashes').document(email_hash).set({'userId': google_id})
+    else:
+        # A fresh login usually means a new device token is about to be registered
+        invalidate_fcm_token_cache(google_id)
         
     app_token = jwt.encode({'user_id': google_id, 'email': user_email, 'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=30)}, JWT_SECRET_KEYS[0], algorithm="HS256")
     return jsonify({"token": app_token}), 200
@@ -239,9 +245,9 @@ def auth_google():
 def health_check():
     """Performs a non-destructive health check for the auth module."""
     try:
-        _ = list(db.collection('users').limit(1).stream())
-        _ = list(db.collection('email_mappings').limit(1).stream())
-        _ = list(db.collection('verification_attempts').limit(1).stream())
+        _ = list(db.collection('users').select([]).limit(1).stream())
+        _ = list(db.collection('email_mappings').select([]).limit(1).stream())
+        _ = list(db.collection('verification_attempts').select([]).limit(1).stream())
         return {"status": "OK", "details": "Firestore collections are accessible."}
     except Exception as e:
         return {"status": "ERROR", "details": f"Failed to query Firestore collections: {str(e)}"}
\ No newline at end of file
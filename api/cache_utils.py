@@ -1,12 +1,90 @@
-from dependencies import redis_client
+import logging
+import redis
+from dependencies import redis_client, io_executor
+
+# The API and Celery writers invalidate summaries, but the image_resizer Cloud
+# Function updates avatarUrl without Redis access, so the TTL must stay short.
+USER_SUMMARY_CACHE_TTL = 300
 
 def get_user_summary_cache_key(user_id):
     """Generates the standard Redis key for a user summary."""
     return f"user_summary:{user_id}"
 
+# The quickview is refreshed constantly by the app's top bar; the short TTL
+# covers writers that don't invalidate it explicitly.
+USER_QUICKVIEW_CACHE_TTL = 30
+
+def get_user_quickview_cache_key(user_id):
+    """Generates the standard Redis key for a user's cached /me/quickview payload."""
+    return f"user_quickview:{user_id}"
+
 def invalidate_user_summary_cache(user_id):
-    """Deletes a user's summary from the Redis cache."""
+    """Deletes a user's summary, and the quickview built from the same fields, from the Redis cache."""
+    redis_conn = redis_client()
+    if redis_conn and user_id:
+        redis_conn.unlink(get_user_summary_cache_key(user_id), get_user_quickview_cache_key(user_id))
+
+def invalidate_user_summary_cache_async(user_id):
+    """Fire-and-forget variant for request handlers whose response doesn't depend on the invalidation."""
+    future = io_executor.submit(invalidate_user_summary_cache, user_id)
+    future.add_done_callback(lambda f: _log_invalidation_failure(f, user_id))
+
+def _log_invalidation_failure(future, user_id):
+    # Nobody waits on the async invalidation, so a failure would otherwise vanish
+    # and leave a stale summary until the TTL runs out.
+    error = future.exception()
+    if error is not None:
+        logging.error(f"Failed to invalidate user summary cache for user {user_id}: {error}")
+
+def invalidate_user_quickview_cache(user_id):
+    """Deletes a user's cached /me/quickview payload from Redis."""
+    redis_conn = redis_client()
+    if redis_conn and user_id:
+        key = get_user_quickview_cache_key(user_id)
+        redis_conn.unlink(key)
+
+# A team challenge's host never changes, so the mapping only needs a TTL to bound memory
+TEAM_HOST_CACHE_TTL = 7 * 86400
+
+def get_team_host_cache_key(team_challenge_id):
+    """Generates the standard Redis key for a team challenge's hostId."""
+    return f"tc:host:{team_challenge_id}"
+
+def get_fcm_token_cache_key(user_id):
+    """Generates the standard Redis key for a user's cached notification target."""
+    return f"fcm:{user_id}"
+
+def invalidate_fcm_token_cache(user_id):
+    """Deletes a user's cached FCM token and notification settings from Redis."""
     redis_conn = redis_client()
     if redis_conn and user_id:
-        key = get_user_summary_cache_key(user_id)
-        redis_conn.delete(key)
\ No newline at end of file
+        key = get_fcm_token_cache_key(user_id)
+        redis_conn.delete(key)
+
+
+# Usernames are never released once claimed, so a cached name only goes stale if
+# its mapping is removed by hand. Each name has its own key, so that TTL bounds the
+# staleness per name instead of being refreshed by every new signup.
+TAKEN_USERNAME_KEY = "username_taken:{}"
+TAKEN_USERNAME_TTL = 86400
+
+def is_username_cached_as_taken(username):
+    """Returns True if the username is known to be taken without touching Firestore."""
+    redis_conn = redis_client()
+    if not redis_conn or not username:
+        return False
+    try:
+        return bool(redis_conn.exists(TAKEN_USERNAME_KEY.format(username)))
+    except redis.exceptions.RedisError as e:
+        # Callers fall through to the authoritative Firestore check
+        logging.error(f"Failed to read taken-username cache for '{username}': {e}")
+        return False
+
+def mark_username_taken(username):
+    """Records a claimed username in the Redis negative cache."""
+    redis_conn = redis_client()
+    if redis_conn and username:
+        try:
+            redis_conn.set(TAKEN_USERNAME_KEY.format(username), 1, ex=TAKEN_USERNAME_TTL)
+        except redis.exceptions.RedisError as e:
+            logging.error(f"Failed to cache taken username '{username}': {e}")
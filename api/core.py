@@ -8,6 +8,7 @@ from .pydantic_models import InitiateUploadRequest, UploadCompleteRequest
 from .config import db, storage_client, tasks_client, GCP_PROJECT_ID, GCP_QUEUE_LOCATION, GCP_QUEUE_ID, WORKER_TARGET_URL, GCS_BUCKET_NAME
 from .auth import token_required
 from .error_utils import create_error_response, handle_exception, not_found_error, server_error
+from .cache_utils import invalidate_fcm_token_cache
 
 core_bp = Blueprint('core_bp', __name__)
 
@@ -20,6 +21,7 @@ def logout(user_id):
     try:
         user_ref = db.collection('users').document(user_id)
         user_ref.update({"fcmToken": firestore.DELETE_FIELD})
+        invalidate_fcm_token_cache(user_id)
         return jsonify({"message": "Logout successful"}), 200
     except Exception as e:
         return handle_exception(e, "logout endpoint")
@@ -50,6 +52,9 @@ def initiate_upload(user_id):
             'status': 'PENDING_UPLOAD',
             'timestamp': firestore.SERVER_TIMESTAMP
         })
+        # The client sends its current token here; drop a cached one that may have rotated
+        if req_data.fcm_token:
+            invalidate_fcm_token_cache(user_id)
         
         try:
             blob = storage_client.bucket(GCS_BUCKET_NAME).blob(gcs_filename)
@@ -1,7 +1,8 @@
 import logging
 import json
 import uuid
-from flask import Blueprint, request, jsonify
+import hashlib
+from flask import Blueprint, request, jsonify, Response
 from google.cloud import firestore
 
 from .config import db, redis_client
@@ -163,28 +164,38 @@ def get_v2_leaderboard(user_id):
         if final_my_rank_entry:
             final_my_rank_entry.docId = final_my_rank_entry.userId
 
-        final_page = [entry.model_dump() for entry in final_entries]
-        
-        return jsonify({
-            "leaderboardPage": final_page,
-            "myRank": final_my_rank_entry.model_dump() if final_my_rank_entry else None,
-            "totalUsers": total_users
-        }), 200
+        response_model = V2LeaderboardResponse(
+            leaderboardPage=final_entries,
+            myRank=final_my_rank_entry,
+            totalUsers=total_users
+        )
+        # Serialize straight to JSON in pydantic-core instead of dumping to dicts for jsonify
+        return Response(response_model.model_dump_json(), mimetype='application/json', status=200)
 
     except Exception as e:
         logging.error(f"Error fetching v2 leaderboard: {e}", exc_info=True)
         return jsonify({"error": "Could not load leaderboard data."}), 500
 
     
+CHALLENGES_CACHE_KEY = "challenges_cache"
+CHALLENGES_ETAG_CACHE_KEY = "challenges_cache:etag"
+CHALLENGES_CACHE_TTL = 3600
+
+def _challenges_response(body, etag):
+    """Wraps the serialized challenge list, answering 304 when the client's If-None-Match is current."""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response.make_conditional(request)
+
 @gamification_bp.route('/challenges', methods=['GET'])
 def get_challenges():
     """Fetches the list of currently active challenges, with caching."""
-    cache_key = "challenges_cache"
     redis_conn = redis_client()
     if redis_conn:
-        cached_response = redis_conn.get(cache_key)
-        if cached_response:
-            return jsonify(json.loads(cached_response)), 200
+        cached_body, cached_etag = redis_conn.mget(CHALLENGES_CACHE_KEY, CHALLENGES_ETAG_CACHE_KEY)
+        if cached_body and cached_etag:
+            return _challenges_response(cached_body, cached_etag)
             
     query = db.collection('challenges').where(filter=firestore.FieldFilter('isActive', '==', True))
     active_challenges = [doc.to_dict() for doc in query.stream()]
@@ -215,10 +226,16 @@ def get_challenges():
         "pagination": None  # Android expects this field even if null
     }
         
+    body = json.dumps(response_data, default=str)
+    etag = hashlib.md5(body.encode('utf-8'), usedforsecurity=False).hexdigest()
     if redis_conn:
-        redis_conn.set(cache_key, json.dumps(response_data, default=str), ex=3600) # Cache for 1 hour
+        # Body and ETag are written together so a cached body always has a matching tag
+        pipe = redis_conn.pipeline()
+        pipe.set(CHALLENGES_CACHE_KEY, body, ex=CHALLENGES_CACHE_TTL)
+        pipe.set(CHALLENGES_ETAG_CACHE_KEY, etag, ex=CHALLENGES_CACHE_TTL)
+        pipe.execute()
         
-    return jsonify(response_data), 200
+    return _challenges_response(body, etag)
 
 
 @gamification_bp.route('/challenges/team-up', methods=['POST'])
@@ -322,8 +339,8 @@ def health_check():
     """
     try:
         # Checks if the leaderboard query index is working.
-        _ = list(db.collection('users').order_by('totalPoints', direction=firestore.Query.DESCENDING).limit(1).stream())
-        _ = list(db.collection('challenges').where(filter=firestore.FieldFilter('isActive', '==', True)).limit(1).stream())
+        _ = list(db.collection('users').order_by('totalPoints', direction=firestore.Query.DESCENDING).select([]).limit(1).stream())
+        _ = list(db.collection('challenges').where(filter=firestore.FieldFilter('isActive', '==', True)).select([]).limit(1).stream())
         return {"status": "OK", "details": "Firestore collections and leaderboard index are accessible."}
     except Exception as e:
         # This will catch errors if the required indexes are missing.
@@ -0,0 +1,68 @@
+# FILE: trackeco-backend/api/llm_cache.py
+
+import hashlib
+import logging
+import orjson
+from .config import redis_client
+from .prompts import AI_ANALYSIS_PROMPT
+from .pydantic_models import AnalysisResult
+
+# Verdicts are keyed by content, so identical (video, challenges) pairs skip the model entirely.
+VERDICT_CACHE_TTL = 7 * 86400
+
+# Fingerprint of everything that shapes a verdict apart from the request itself: the whole
+# prompt template and the response schema. The model settings are mixed in per key.
+_VERDICT_CONTRACT_HASH = hashlib.sha256(
+    AI_ANALYSIS_PROMPT.encode('utf-8')
+    + orjson.dumps(AnalysisResult.model_json_schema(), option=orjson.OPT_SORT_KEYS)
+).digest()
+
+def make_verdict_key(video_bytes, challenges_context, model_settings):
+    """
+    Builds the content-addressed cache key for an analysis verdict.
+
+    Args:
+        video_bytes (bytes): The raw uploaded video.
+        challenges_context (str): The canonical challenge blocks injected into the prompt.
+        model_settings (str): The model name and generation settings used for the call.
+
+    Returns:
+        str: The Redis key for this (video, challenges) pair under the current prompt, schema and model.
+    """
+    version = hashlib.sha256(_VERDICT_CONTRACT_HASH + model_settings.encode('utf-8')).hexdigest()[:16]
+    video_hash = hashlib.sha256(video_bytes).digest()
+    digest = hashlib.sha256(video_hash + challenges_context.encode('utf-8')).hexdigest()
+    return f"llm_verdict:{version}:{digest}"
+
+def get_cached_verdict(key):
+    """Returns the cached verdict JSON string for the key, or None on a miss."""
+    redis_conn = redis_client()
+    if not redis_conn:
+        return None
+    try:
+        return redis_conn.get(key)
+    except Exception as e:
+        logging.warning(f"Verdict cache lookup failed for {key}: {e}")
+        return None
+
+def put_cached_verdict(key, verdict, verdict_json):
+    """Stores a parsed verdict under the key. Error verdicts are never cached so they can be retried."""
+    if verdict.get('error'):
+        return
+    redis_conn = redis_client()
+    if not redis_conn:
+        return
+    try:
+        redis_conn.set(key, verdict_json, ex=VERDICT_CACHE_TTL)
+    except Exception as e:
+        logging.warning(f"Verdict cache write failed for {key}: {e}")
+
+def delete_cached_verdict(key):
+    """Drops a cached verdict, e.g. one that no longer matches the analysis schema."""
+    redis_conn = redis_client()
+    if not redis_conn:
+        return
+    try:
+        redis_conn.delete(key)
+    except Exception as e:
+        logging.warning(f"Verdict cache delete failed for {key}: {e}")
@@ -1,8 +1,38 @@
 # FILE: trackeco-backend/api/notifications.py
 
+import json
 import logging
 from firebase_admin import messaging
-from .config import db
+from .config import db, redis_client
+from .cache_utils import get_fcm_token_cache_key
+
+# The token plus every setting_name used by callers; cached together so a
+# notification needs no Firestore read on a cache hit.
+NOTIFICATION_FIELDS = ['fcmToken', 'streakRemindersEnabled', 'socialRemindersEnabled', 'analysisRemindersEnabled']
+# The client registers and refreshes its token directly in Firestore, so the
+# backend can't invalidate on every change; the short TTL bounds how long a
+# rotated token goes unnoticed.
+FCM_TOKEN_CACHE_TTL = 600
+
+def _get_notification_target(user_id):
+    """Returns the user's FCM token and notification settings, or None if the user doesn't exist."""
+    redis_conn = redis_client()
+    cache_key = get_fcm_token_cache_key(user_id)
+    if redis_conn:
+        cached_target = redis_conn.get(cache_key)
+        if cached_target:
+            return json.loads(cached_target)
+
+    user_doc = db.collection('users').document(user_id).get(NOTIFICATION_FIELDS)
+    if not user_doc.exists:
+        return None
+
+    target = user_doc.to_dict()
+    # A user without a token (e.g. after logout) is re-read next time, so a
+    # newly registered token is picked up immediately.
+    if redis_conn and target.get('fcmToken'):
+        redis_conn.setex(cache_key, FCM_TOKEN_CACHE_TTL, json.dumps(target))
+    return target
 
 def send_notification(user_id, title, body, data=None, setting_name=None):
     """
@@ -17,15 +47,12 @@ def send_notification(user_id, title, body, data=None, setting_name=None):
                                       that controls this notification type (e.g., 'socialRemindersEnabled').
     """
     try:
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        user_data = _get_notification_target(user_id)
         
-        if not user_doc.exists:
+        if user_data is None:
             logging.warning(f"Attempted to send notification to non-existent user: {user_id}")
             return
 
-        user_data = user_doc.to_dict()
-
         # --- SETTINGS CHECK ---
         if setting_name:
             # If the setting field exists and is False, stop. Default to True if field is missing.
@@ -1,10 +1,13 @@
 import hashlib
+import logging
 from flask import Blueprint, request, jsonify
 from google.cloud import firestore
 
 from .pydantic_models import OnboardingProfile, OnboardingSurvey, OnboardingReferral
 from .config import db
 from .auth import token_required # Import the decorator from our auth blueprint
+from .sanitization import is_valid_username
+from .cache_utils import is_username_cached_as_taken, mark_username_taken, invalidate_user_summary_cache, invalidate_user_quickview_cache
 from tasks import sync_user_to_algolia_task
 
 onboarding_bp = Blueprint('onboarding_bp', __name__)
@@ -23,12 +26,21 @@ def set_username_transaction(transaction, username_ref, user_ref, username, disp
 def onboarding_profile(user_id):
     req_data = OnboardingProfile.model_validate(request.get_json())
     username = req_data.username.lower().strip()
+    if not is_valid_username(username):
+        return jsonify({"error_code": "INVALID_USERNAME", "message": "Usernames are 1-30 letters, digits, underscores or hyphens."}), 400
+    # Known-taken usernames are rejected before opening a transaction
+    if is_username_cached_as_taken(username):
+        return jsonify({"error_code": "USERNAME_TAKEN", "message": "Username already exists."}), 409
     user_ref, username_ref = db.collection('users').document(user_id), db.collection('usernames').document(username)
     try:
         set_username_transaction(db.transaction(), username_ref, user_ref, username, req_data.displayName)
+        mark_username_taken(username)
+        invalidate_user_summary_cache(user_id)
         sync_user_to_algolia_task.delay(user_id)
         return jsonify({"message": "Profile step complete"}), 200
-    except ValueError as e: return jsonify({"error_code": "USERNAME_TAKEN", "message": str(e)}), 409
+    except ValueError as e:
+        mark_username_taken(username)
+        return jsonify({"error_code": "USERNAME_TAKEN", "message": str(e)}), 409
     except Exception as e: return jsonify({"error_code": "SERVER_ERROR", "message": str(e)}), 500
 
 @onboarding_bp.route('/survey', methods=['POST'])
@@ -36,8 +48,12 @@ def onboarding_profile(user_id):
 def onboarding_survey(user_id):
     req_data = OnboardingSurvey.model_validate(request.get_json())
     user_ref = db.collection('users').document(user_id)
-    user_ref.collection('privateSurvey').document('responses').set(req_data.model_dump())
-    user_ref.update({'onboardingStep': 2})
+    # One commit for the survey payload and the step marker
+    batch = db.batch()
+    batch.set(user_ref.collection('privateSurvey').document('responses'), req_data.model_dump())
+    batch.update(user_ref, {'onboardingStep': 2})
+    batch.commit()
+    invalidate_user_quickview_cache(user_id)
     return jsonify({"message": "Survey step complete"}), 200
 
 @onboarding_bp.route('/referral', methods=['POST'])
@@ -45,34 +61,34 @@ def onboarding_survey(user_id):
 def onboarding_referral(user_id):
     req_data = OnboardingReferral.model_validate(request.get_json())
     user_ref = db.collection('users').document(user_id)
+    user_update = {'onboardingStep': 3}
     if req_data.referralCode:
         code_ref = db.collection('referral_codes').document(req_data.referralCode)
         code_doc = code_ref.get(['userId'])
         if code_doc.exists:
             referrer_id = code_doc.to_dict().get('userId')
-            if referrer_id != user_id: user_ref.update({'referredBy': referrer_id})
+            if referrer_id != user_id: user_update['referredBy'] = referrer_id
     
     # If the user granted contact permissions, save their hashed contacts
+    # BulkWriter pipelines the writes with automatic backoff and isn't bound by the 500-op batch limit
     if req_data.contactHashes:
-        batch = db.batch()
+        writer = db.bulk_writer()
+        contact_hashes_ref = db.collection('contact_hashes')
         for chash in req_data.contactHashes:
-            hash_ref = db.collection('contact_hashes').document(chash)
             # Store the user's ID against their hashed contact info
-            batch.set(hash_ref, {'userId': user_id})
-        batch.commit()
+            writer.set(contact_hashes_ref.document(chash), {'userId': user_id, 'updatedAt': firestore.SERVER_TIMESTAMP}, merge=True)
+        writer.close()
         
-    user_ref.update({'onboardingStep': 3})
+    user_ref.update(user_update)
+    invalidate_user_quickview_cache(user_id)
     return jsonify({"message": "Referral step complete"}), 200
 
 @onboarding_bp.route('/finish', methods=['POST'])
 @token_required
 def onboarding_finish(user_id):
-    import logging
     try:
-        # Add debug logging to track the update operation
-        logging.debug(f"Updating user {user_id} onboarding: step=4, complete=True")
         db.collection('users').document(user_id).update({'onboardingStep': 4, 'onboardingComplete': True})
-        logging.debug(f"Successfully updated user {user_id} onboarding status")
+        invalidate_user_quickview_cache(user_id)
         return jsonify({"message": "Onboarding complete"}), 200
     except Exception as e:
         logging.error(f"Failed to update onboarding status for user {user_id}: {str(e)}")
@@ -83,8 +99,8 @@ def health_check():
     Performs a non-destructive health check for the onboarding module.
     """
     try:
-        _ = list(db.collection('usernames').limit(1).stream())
-        _ = list(db.collection('referral_codes').limit(1).stream())
+        _ = list(db.collection('usernames').select([]).limit(1).stream())
+        _ = list(db.collection('referral_codes').select([]).limit(1).stream())
         return {"status": "OK", "details": "Firestore collections are accessible."}
     except Exception as e:
         return {"status": "ERROR", "details": f"Failed to query Firestore collections: {str(e)}"}
\ No newline at end of file
@@ -1,17 +1,30 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Union
+import re
+from pydantic import BaseModel, Field, AfterValidator
+from pydantic_core import PydanticCustomError
+from typing import Annotated, Dict, List, Optional, Union
+
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+def _validate_email(value: str) -> str:
+    if not EMAIL_RE.match(value):
+        # PydanticCustomError keeps the error ctx JSON-serializable for the 400 handler
+        raise PydanticCustomError('value_error', 'value is not a valid email address')
+    return value
+
+# Shape check only; sanitize_email handles normalization after validation
+Email = Annotated[str, AfterValidator(_validate_email)]
 
 # --- AUTH & ONBOARDING ---
 class AuthRequest(BaseModel):
-    email: EmailStr
+    email: Email
     password: str
 
 class VerifyRequest(BaseModel):
-    email: EmailStr
+    email: Email
     code: str
 
 class ResendCodeRequest(BaseModel):
-    email: EmailStr
+    email: Email
 
 class GoogleAuthRequest(BaseModel):
     id_token: str
@@ -60,7 +73,7 @@ class UserSearchResponse(BaseModel):
 
 # --- SOCIAL & FRIENDS ---
 class FriendRequest(BaseModel):
-    targetUserId: str
+    targetUserId: str = Field(min_length=1)
 
 class FriendResponseRequest(BaseModel):
     requesterUserId: str
@@ -111,6 +124,12 @@ class V2LeaderboardResponse(BaseModel):
     myRank: Optional[UserSummary] = None
     totalUsers: int = 0
 
+# The response for the /social/friends endpoint
+class FriendsResponse(BaseModel):
+    friends: List[UserSummary] = []
+    sentRequests: List[UserSummary] = []
+    receivedRequests: List[UserSummary] = []
+
 # The response for the /users/{userId}/profile endpoint
 class PublicProfileResponse(BaseModel):
     userId: str
@@ -135,7 +154,7 @@ class ProfileResponse(BaseModel):
     onboardingComplete: bool
     onboardingStep: int
     completedChallengeIds: List[str] = []
-    challengeProgress: dict = {}
+    challengeProgress: Dict[str, int] = {}  # challengeId -> progress toward progressGoal
     activeTeamChallenges: List[str] = []
     teamChallengeInvitations: List[TeamChallengeInvitation] = []
     friends: List[UserSummary] = []
@@ -153,4 +172,27 @@ class UpdateSettingsRequest(BaseModel):
     socialRemindersEnabled: Optional[bool] = None
     analysisRemindersEnabled: Optional[bool] = None
     showDisplayNameInLeaderboard: Optional[bool] = None
-    showAvatarInLeaderboard: Optional[bool] = None
\ No newline at end of file
+    showAvatarInLeaderboard: Optional[bool] = None
+# --- AI RESPONSE SCHEMAS ---
+# Passed to Gemini as response_schema. The Gemini API rejects non-null
+# defaults in response schemas, so fields are either required or default to None.
+
+class ChallengeUpdate(BaseModel):
+    challengeId: str = Field(description="The challengeId from GlobalChallenges; never one listed in UserCompletedChallengeIds.")
+    isCompleted: Optional[bool] = Field(default=None, description="True when a simple challenge (no progressGoal) was completed.")
+    progress: Optional[int] = Field(default=None, description="Number of qualifying items counted toward a progress challenge.")
+
+class AnalysisResult(BaseModel):
+    baseScore: int
+    effortScore: int
+    creativityScore: int
+    penaltyPoints: int
+    finalScore: int
+    suggestion: Optional[str] = None
+    challengeUpdates: List[ChallengeUpdate]
+    error: Optional[str] = None
+
+class ChallengeSpec(BaseModel):
+    description: str = Field(description="The clear, user-facing challenge description. Must include the goal number for progress types.")
+    bonusPoints: int = Field(description="Points based on difficulty (daily: 5-20, weekly: 70-150, monthly: 700-1000).")
+    progressGoal: Optional[int] = Field(description="The target number for progress challenges. MUST be null for simple challenges.")
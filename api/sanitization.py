@@ -5,16 +5,45 @@ Provides protection against XSS, injection attacks, and malformed data.
 
 import re
 import html
+import string
 from typing import Any, Dict, List, Optional
 import logging
 
+# Hard cap applied even when no max_length is given, so hostile payloads cost bounded work
+MAX_INPUT_LENGTH = 1024 * 1024
+
+# Built once at import; these run for every sanitized request field.
+# Control characters except tab, newline and carriage return, mapped to None for str.translate
+_CTRL_DELETE = dict.fromkeys([*range(0x00, 0x09), 0x0b, 0x0c, *range(0x0e, 0x20), 0x7f])
+# Characters that html.escape or the control-character pass would change
+_NEEDS_SANITIZING = frozenset('&<>"\'').union(map(chr, _CTRL_DELETE))
+_ALLOWED_URL_SCHEMES = ('http://', 'https://', 'data:image/')
+_USERNAME_STRIP_RE = re.compile(r'[^a-zA-Z0-9_-]+')
+_USERNAME_RE = re.compile(r'[a-z0-9_-]{1,30}')
+_EMAIL_LOCAL_CHARS = frozenset(string.ascii_letters + string.digits + "._%+-")
+_EMAIL_DOMAIN_CHARS = frozenset(string.ascii_letters + string.digits + ".-")
+_ASCII_LETTERS = frozenset(string.ascii_letters)
+
+def _is_valid_email(email: str) -> bool:
+    """
+    Linear-time equivalent of ^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,}$,
+    with no backtracking on hostile input.
+    """
+    local, sep, domain = email.partition('@')
+    if not sep or not local or not _EMAIL_LOCAL_CHARS.issuperset(local):
+        return False
+    if not _EMAIL_DOMAIN_CHARS.issuperset(domain):
+        return False
+    host, dot, tld = domain.rpartition('.')
+    return bool(dot and host) and len(tld) >= 2 and _ASCII_LETTERS.issuperset(tld)
+
 def sanitize_string(input_str: str, max_length: Optional[int] = None) -> str:
     """
     Sanitize a string input by:
     1. Stripping leading/trailing whitespace
-    2. HTML escaping to prevent XSS
-    3. Truncating to max_length if specified
-    4. Removing control characters
+    2. Removing control characters
+    3. HTML escaping to prevent XSS
+    4. Truncating to max_length if specified (never beyond MAX_INPUT_LENGTH)
     
     Args:
         input_str: The input string to sanitize
@@ -28,19 +57,33 @@ def sanitize_string(input_str: str, max_length: Optional[int] = None) -> str:
             return ""
         return str(input_str)
     
+    limit = min(max_length, MAX_INPUT_LENGTH) if max_length else MAX_INPUT_LENGTH
+    
+    # Fast path: most fields are already clean, so return them without any copies
+    if (len(input_str) <= limit
+            and not input_str[:1].isspace() and not input_str[-1:].isspace()
+            and _NEEDS_SANITIZING.isdisjoint(input_str)):
+        return input_str
+    
     # Strip whitespace and basic sanitization
     sanitized = input_str.strip()
-    
-    # HTML escape to prevent XSS
-    sanitized = html.escape(sanitized)
+    if len(sanitized) > MAX_INPUT_LENGTH:
+        sanitized = sanitized[:MAX_INPUT_LENGTH]
     
     # Remove control characters (except tab, newline, carriage return)
-    sanitized = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]', '', sanitized)
+    sanitized = sanitized.translate(_CTRL_DELETE)
+    
+    # Escaping only ever lengthens the text, so nothing past the first `limit` characters
+    # can survive truncation; cut before html.escape instead of escaping the whole payload.
+    truncated = len(sanitized) > limit
+    sanitized = html.escape(sanitized[:limit])
     
     # Truncate if max_length specified
-    if max_length and len(sanitized) > max_length:
-        sanitized = sanitized[:max_length]
-        logging.warning(f"Input truncated from {len(input_str)} to {max_length} characters")
+    if len(sanitized) > limit:
+        sanitized = sanitized[:limit]
+        truncated = True
+    if truncated:
+        logging.warning(f"Input truncated from {len(input_str)} to {limit} characters")
     
     return sanitized
 
@@ -60,8 +103,7 @@ def sanitize_email(email: str) -> str:
     email = sanitize_string(email).lower()
     
     # Basic email format validation
-    email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    if not re.match(email_regex, email):
+    if not _is_valid_email(email):
         logging.warning(f"Invalid email format: {email}")
         # Still return sanitized version but log warning
         return email
@@ -81,10 +123,10 @@ def sanitize_username(username: str) -> str:
     if not username:
         return ""
     
-    username = sanitize_string(username)
-    
-    # Remove any non-alphanumeric characters except underscores and hyphens
-    username = re.sub(r'[^a-zA-Z0-9_-]', '', username)
+    # Remove any non-alphanumeric characters except underscores and hyphens. The allow-list
+    # already excludes whitespace, markup and control characters, so this one pass replaces
+    # the general sanitize_string (whose escaping could only inject entity letters here).
+    username = _USERNAME_STRIP_RE.sub('', str(username))
     
     # Enforce reasonable length limits
     if len(username) > 30:
@@ -93,25 +135,40 @@ def sanitize_username(username: str) -> str:
     
     return username
 
+def is_valid_username(username: str) -> bool:
+    """
+    Check a normalized (lowercased, stripped) username against the claimable format:
+    1-30 characters of lowercase letters, digits, underscores and hyphens.
+    This also guarantees the name is a safe Firestore document id.
+    """
+    return bool(username) and _USERNAME_RE.fullmatch(username) is not None
+
 def sanitize_url(url: str) -> str:
     """
     Sanitize URL input to prevent XSS and malformed URLs.
     
+    URLs are validated rather than HTML-escaped: escaping would turn `&` in
+    query strings into `&amp;` and break the URL.
+    
     Args:
         url: URL to sanitize
         
     Returns:
-        Sanitized URL
+        Sanitized URL, or "" if it contains control characters or uses a
+        scheme other than http, https, or data:image
     """
     if not url:
         return ""
     
-    url = sanitize_string(url)
+    url = str(url).strip()
+    if not url.isprintable():
+        logging.warning("Rejected URL containing control characters")
+        return ""
     
-    # Basic URL validation - allow only http, https, and data URLs for avatars
-    if url and not url.startswith(('http://', 'https://', 'data:image/')):
-        logging.warning(f"Potentially unsafe URL scheme: {url}")
-        # Still return sanitized version but log warning
+    # Allow only http, https, and data URLs for avatars; schemes are case-insensitive
+    if not url[:11].lower().startswith(_ALLOWED_URL_SCHEMES):
+        logging.warning(f"Rejected URL with unsafe scheme: {url[:100]}")
+        return ""
     
     return url
 
@@ -226,4 +283,4 @@ UPLOAD_RULES = {
     'filename': lambda x: sanitize_string(x, 100),
     'upload_id': sanitize_string,
     'fcm_token': sanitize_string
-}
\ No newline at end of file
+}
@@ -1,12 +1,19 @@
 # FILE: trackeco-backend/api/search_utils.py
 
+import hashlib
 import logging
-from .config import db, algolia_client, ALGOLIA_INDEX_NAME
+import orjson
+from .config import db, algolia_client, ALGOLIA_INDEX_NAME, redis_client
+
+# Fingerprint of the last record pushed to Algolia per user, so unchanged syncs become no-ops
+ALGOLIA_SYNC_HASH_KEY = "algolia_sync:{}"
+ALGOLIA_SYNC_HASH_TTL = 7 * 86400
 
 def sync_user_to_algolia(user_id):
     """
     Fetches the latest user data from Firestore and syncs it to Algolia
-    using the add_or_update_object method.
+    using the partial_update_object method, skipping the write entirely
+    when the indexed fields have not changed since the last sync.
     """
     logging.info(f"[Algolia Sync] Starting sync for user_id: {user_id}")
     
@@ -22,6 +29,9 @@ def sync_user_to_algolia(user_id):
             logging.warning(f"[Algolia Sync] User {user_id} not found in Firestore. Deleting from Algolia.")
             # This method correctly deletes the object if the user is removed from Firestore.
             algolia_client.delete_object(index_name=ALGOLIA_INDEX_NAME, object_id=user_id)
+            redis_conn = redis_client()
+            if redis_conn:
+                redis_conn.delete(ALGOLIA_SYNC_HASH_KEY.format(user_id))
             logging.info(f"[Algolia Sync] Successfully deleted user {user_id} from Algolia.")
             return
 
@@ -37,15 +47,25 @@ def sync_user_to_algolia(user_id):
             'totalPoints': user_data.get('totalPoints', 0)
         }
         
-        # --- FIX: Using the correct add_or_update_object() method ---
+        # Most syncs follow a change to a field Algolia doesn't index; skip those writes
+        record_hash = hashlib.blake2b(orjson.dumps(record_body, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+        hash_key = ALGOLIA_SYNC_HASH_KEY.format(user_id)
+        redis_conn = redis_client()
+        if redis_conn and redis_conn.get(hash_key) == record_hash:
+            logging.info(f"[Algolia Sync] Record for {user_id} unchanged; skipping Algolia write.")
+            return
+        
         logging.info(f"[Algolia Sync] Saving record to Algolia for objectID '{user_id}': {record_body}")
         
-        algolia_client.add_or_update_object(
+        # Only the indexed attributes are touched; create_if_not_exists covers first-time syncs
+        algolia_client.partial_update_object(
             index_name=ALGOLIA_INDEX_NAME,
             object_id=user_id,
-            body=record_body
+            attributes_to_update=record_body,
+            create_if_not_exists=True
         )
-        # --------------------------------------------------------------------------
+        if redis_conn:
+            redis_conn.set(hash_key, record_hash, ex=ALGOLIA_SYNC_HASH_TTL)
         
         logging.info(f"[Algolia Sync] SUCCESS: Successfully synced user {user_id} to Algolia.")
 
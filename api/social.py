@@ -1,14 +1,35 @@
 import logging
-from flask import Blueprint, request, jsonify
+import orjson
+from functools import lru_cache
+from typing import List
+from flask import Blueprint, Response, request, jsonify
 from google.cloud import firestore
+from pydantic import TypeAdapter
 
-from .pydantic_models import FriendRequest, FriendResponseRequest, ContactHashesRequest
+from .pydantic_models import FriendRequest, FriendResponseRequest, ContactHashesRequest, FriendsResponse, UserSummary
 from dependencies import db
 from .auth import token_required
 from .users import get_user_profiles_from_ids
-from .notifications import send_notification
+from tasks import send_social_notification_task
 social_bp = Blueprint('social_bp', __name__)
 
+# Serializes profile lists straight to JSON bytes, without per-profile dicts
+_USER_SUMMARY_LIST = TypeAdapter(List[UserSummary])
+
+# Fixed success bodies, encoded once; each request still gets its own Response object
+_REQUEST_SENT_BODY = orjson.dumps({"message": "Friend request sent."})
+_REQUEST_ACCEPTED_BODY = orjson.dumps({"message": "Friend request accepted."})
+_REQUEST_DECLINED_BODY = orjson.dumps({"message": "Friend request declined."})
+_FRIEND_REMOVED_BODY = orjson.dumps({"message": "Friend removed."})
+
+_USERS = db.collection('users')
+_EMAIL_HASHES = db.collection('email_hashes')
+
+@lru_cache(maxsize=4096)
+def _user_ref(uid):
+    """Returns the (immutable) DocumentReference for a user, reused across requests."""
+    return _USERS.document(uid)
+
 # --- Transactional Helper ---
 @firestore.transactional
 def process_friend_request_transaction(transaction, current_user_ref, requester_ref):
@@ -19,13 +40,15 @@ def process_friend_request_transaction(transaction, current_user_ref, requester_
     requester_id = requester_ref.id
     current_user_id = current_user_ref.id
     
-    # Add to friends lists for both users
-    transaction.update(current_user_ref, {'friends': firestore.ArrayUnion([requester_id])})
-    transaction.update(requester_ref, {'friends': firestore.ArrayUnion([current_user_id])})
-    
-    # Remove from pending request lists for both users
-    transaction.update(current_user_ref, {'friendRequestsReceived': firestore.ArrayRemove([requester_id])})
-    transaction.update(requester_ref, {'friendRequestsSent': firestore.ArrayRemove([current_user_id])})
+    # Add to friends lists and remove the pending request, one update per user document
+    transaction.update(current_user_ref, {
+        'friends': firestore.ArrayUnion([requester_id]),
+        'friendRequestsReceived': firestore.ArrayRemove([requester_id])
+    })
+    transaction.update(requester_ref, {
+        'friends': firestore.ArrayUnion([current_user_id]),
+        'friendRequestsSent': firestore.ArrayRemove([current_user_id])
+    })
 
 # --- Endpoints ---
 
@@ -35,36 +58,27 @@ def send_friend_request(user_id):
     """Adds a user ID to the target's received requests and the sender's sent requests."""
     sender_id = user_id
     
-    req_data = request.get_json()
-    target_user_id = req_data.get('targetUserId')
-
-    if not target_user_id:
-        return jsonify({"error": "targetUserId is required"}), 400
+    # Validated before the catch-all below; a missing, malformed or empty targetUserId is a 400 via the ValidationError handler
+    req_data = FriendRequest.model_validate(request.get_json(silent=True) or {})
     try:
-        req_data = FriendRequest.model_validate(request.get_json())
-        if user_id == req_data.targetUserId:
+        target_user_id = req_data.targetUserId
+        if user_id == target_user_id:
             return jsonify({"error": "Cannot add yourself as a friend."}), 400
         
-        current_user_ref = db.collection('users').document(user_id)
-        target_user_ref = db.collection('users').document(req_data.targetUserId)
+        current_user_ref = _user_ref(user_id)
+        target_user_ref = _user_ref(target_user_id)
         
         batch = db.batch()
-        batch.update(current_user_ref, {'friendRequestsSent': firestore.ArrayUnion([req_data.targetUserId])})
+        batch.update(current_user_ref, {'friendRequestsSent': firestore.ArrayUnion([target_user_id])})
         batch.update(target_user_ref, {'friendRequestsReceived': firestore.ArrayUnion([user_id])})
         batch.commit()
-        sender_profile = get_user_profiles_from_ids([sender_id])
-        if sender_profile:
-            sender_name = sender_profile[0].displayName or "Someone"
-            
-            # Send notification to the person RECEIVING the request
-            send_notification(
-                user_id=target_user_id,
-                title="New Friend Request!",
-                body=f"{sender_name} sent you a friend request.",
-                data={"type": "friend_request_received"},
-                setting_name="socialRemindersEnabled"
-            )
-        return jsonify({"message": "Friend request sent."}), 200
+        
+        # Notify the person RECEIVING the request; the name lookup and FCM call happen on the worker
+        send_social_notification_task.delay(
+            sender_id, target_user_id,
+            "New Friend Request!", "{name} sent you a friend request.", "friend_request_received"
+        )
+        return Response(_REQUEST_SENT_BODY, mimetype='application/json', status=200)
     except Exception as e:
         logging.error(f"Error sending friend request from {user_id}: {e}", exc_info=True)
         return jsonify({"error": "Could not send friend request."}), 500
@@ -72,31 +86,24 @@ def send_friend_request(user_id):
 @social_bp.route('/accept', methods=['POST'])
 @token_required
 def accept_friend_request(user_id):
-    acceptor_id = user_id
-    req_data = request.get_json()
-    # This is the user who ORIGINALLY SENT the request
-    requester_user_id = req_data.get('requesterUserId')
     """Accepts a friend request, adding users to each other's friend lists."""
+    acceptor_id = user_id
+    req_data = FriendResponseRequest.model_validate(request.get_json(silent=True) or {})
     try:
-        req_data = FriendResponseRequest.model_validate(request.get_json())
-        current_user_ref = db.collection('users').document(user_id)
-        requester_ref = db.collection('users').document(req_data.requesterUserId)
+        # This is the user who ORIGINALLY SENT the request
+        requester_user_id = req_data.requesterUserId
+        current_user_ref = _user_ref(user_id)
+        requester_ref = _user_ref(requester_user_id)
         
         # Use the atomic transaction to ensure data consistency
         process_friend_request_transaction(db.transaction(), current_user_ref, requester_ref)
-        acceptor_profile = get_user_profiles_from_ids([acceptor_id])
-        if acceptor_profile:
-            acceptor_name = acceptor_profile[0].displayName or "Someone"
-
-            # Send notification to the person who ORIGINALLY SENT the request
-            send_notification(
-                user_id=requester_user_id,
-                title="Friend Request Accepted!",
-                body=f"{acceptor_name} accepted your friend request.",
-                data={"type": "friend_request_accepted"},
-                setting_name="socialRemindersEnabled"
-            ) 
-        return jsonify({"message": "Friend request accepted."}), 200
+        
+        # Notify the person who ORIGINALLY SENT the request; the name lookup and FCM call happen on the worker
+        send_social_notification_task.delay(
+            acceptor_id, requester_user_id,
+            "Friend Request Accepted!", "{name} accepted your friend request.", "friend_request_accepted"
+        )
+        return Response(_REQUEST_ACCEPTED_BODY, mimetype='application/json', status=200)
     except Exception as e:
         logging.error(f"Error accepting friend request for {user_id}: {e}", exc_info=True)
         return jsonify({"error": "Could not accept friend request."}), 500
@@ -107,15 +114,15 @@ def decline_friend_request(user_id):
     """Removes a friend request from both the sender's and receiver's lists."""
     try:
         req_data = FriendResponseRequest.model_validate(request.get_json())
-        current_user_ref = db.collection('users').document(user_id)
-        requester_ref = db.collection('users').document(req_data.requesterUserId)
+        current_user_ref = _user_ref(user_id)
+        requester_ref = _user_ref(req_data.requesterUserId)
         
         batch = db.batch()
         batch.update(current_user_ref, {'friendRequestsReceived': firestore.ArrayRemove([req_data.requesterUserId])})
         batch.update(requester_ref, {'friendRequestsSent': firestore.ArrayRemove([user_id])})
         batch.commit()
         
-        return jsonify({"message": "Friend request declined."}), 200
+        return Response(_REQUEST_DECLINED_BODY, mimetype='application/json', status=200)
     except Exception as e:
         logging.error(f"Error declining friend request for {user_id}: {e}", exc_info=True)
         return jsonify({"error": "Could not decline friend request."}), 500
@@ -126,15 +133,15 @@ def remove_friend(user_id):
     """Removes a user from the current user's friends list, and vice-versa."""
     try:
         req_data = FriendRequest.model_validate(request.get_json())
-        current_user_ref = db.collection('users').document(user_id)
-        friend_ref = db.collection('users').document(req_data.targetUserId)
+        current_user_ref = _user_ref(user_id)
+        friend_ref = _user_ref(req_data.targetUserId)
         
         batch = db.batch()
         batch.update(current_user_ref, {'friends': firestore.ArrayRemove([req_data.targetUserId])})
         batch.update(friend_ref, {'friends': firestore.ArrayRemove([user_id])})
         batch.commit()
         
-        return jsonify({"message": "Friend removed."}), 200
+        return Response(_FRIEND_REMOVED_BODY, mimetype='application/json', status=200)
     except Exception as e:
         logging.error(f"Error removing friend for {user_id}: {e}", exc_info=True)
         return jsonify({"error": "Could not remove friend."}), 500
@@ -148,24 +155,18 @@ def find_by_emails(user_id):
         if not req_data.hashes:
             return jsonify([]), 200
         
-        matching_user_ids = set()
-        # Firestore 'in' queries are limited to 30 items, so we process in chunks
-        for i in range(0, len(req_data.hashes), 30):
-            chunk = req_data.hashes[i:i+30]
-            query = db.collection('email_hashes').where(filter=firestore.FieldFilter.from_document_id("in", chunk))
-            for doc in query.stream():
-                uid = doc.to_dict().get('userId')
-                if uid and uid != user_id:
-                    matching_user_ids.add(uid)
+        # The hashes are document IDs, so one batched multi-get replaces the 30-item 'in' query chunks
+        docs = db.get_all([_EMAIL_HASHES.document(h) for h in set(req_data.hashes)])
+        matching_user_ids = {doc.to_dict().get('userId') for doc in docs if doc.exists}
+        matching_user_ids.discard(None)
+        matching_user_ids.discard(user_id)
 
         if not matching_user_ids:
             return jsonify([]), 200
 
-        # Import the helper here to avoid circular dependency at the top level
-        from .users import get_user_profiles_from_ids
         matching_profiles = get_user_profiles_from_ids(list(matching_user_ids), user_id)
         
-        return jsonify([p.model_dump() for p in matching_profiles]), 200
+        return Response(_USER_SUMMARY_LIST.dump_json(matching_profiles), mimetype='application/json', status=200)
     except Exception as e:
         logging.error(f"Error finding by email for {user_id}: {e}", exc_info=True)
         return jsonify({"error": "Could not perform search."}), 500
@@ -173,10 +174,10 @@ def find_by_emails(user_id):
 def health_check():
     """Performs a non-destructive health check for the social module."""
     try:
-        # Checks if the prefix search query index is working.
-        _ = list(db.collection('users').order_by('displayName').start_at(['a']).end_at(['a' + '\uf8ff']).limit(1).stream())
-        _ = list(db.collection('contact_hashes').limit(1).stream())
-        return {"status": "OK", "details": "Firestore collections and search index are accessible."}
+        # User search is served by Algolia (see /users/search-key), so there is no Firestore search index to probe.
+        _ = list(db.collection('users').select([]).limit(1).stream())
+        _ = list(db.collection('contact_hashes').select([]).limit(1).stream())
+        return {"status": "OK", "details": "Firestore collections are accessible."}
     except Exception as e:
         return {"status": "ERROR", "details": f"Failed to query Firestore collections. Check indexes. Error: {str(e)}"}
     
@@ -186,8 +187,7 @@ def get_all_friend_data(user_id):
     """
     A single, efficient endpoint to get all friend-related data for the current user.
     """
-    user_ref = db.collection('users').document(user_id)
-    user_doc = user_ref.get()
+    user_doc = _user_ref(user_id).get()
 
     if not user_doc.exists:
         return jsonify({"error": "User not found"}), 404
@@ -198,12 +198,13 @@ def get_all_friend_data(user_id):
     sent_request_ids = user_data.get('friendRequestsSent', [])
     received_request_ids = user_data.get('friendRequestsReceived', [])
 
-    friends = [p.model_dump() for p in get_user_profiles_from_ids(friend_ids, user_id)]
-    sent_requests = [p.model_dump() for p in get_user_profiles_from_ids(sent_request_ids, user_id)]
-    received_requests = [p.model_dump() for p in get_user_profiles_from_ids(received_request_ids, user_id)]
+    # Fetch all three lists in one lookup (one cache MGET, one get_all) and partition afterwards
+    all_ids = list(dict.fromkeys([*friend_ids, *sent_request_ids, *received_request_ids]))
+    profiles_by_id = {p.userId: p for p in get_user_profiles_from_ids(all_ids, user_id)}
 
-    return jsonify({
-        "friends": friends,
-        "sentRequests": sent_requests,
-        "receivedRequests": received_requests
-    }), 200
\ No newline at end of file
+    response = FriendsResponse(
+        friends=[profiles_by_id[uid] for uid in friend_ids if uid in profiles_by_id],
+        sentRequests=[profiles_by_id[uid] for uid in sent_request_ids if uid in profiles_by_id],
+        receivedRequests=[profiles_by_id[uid] for uid in received_request_ids if uid in profiles_by_id]
+    )
+    return Response(response.model_dump_json(), mimetype='application/json', status=200)
\ No newline at end of file
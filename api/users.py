@@ -1,9 +1,8 @@
 # FILE: trackeco-backend/api/users.py
 
 import logging
-import json
-from flask import Blueprint, request, jsonify
-from google.cloud import firestore
+import orjson
+from flask import Blueprint, request, jsonify, Response
 import datetime
 from .config import db, storage_client, GCS_BUCKET_NAME, redis_client, algolia_client, ALGOLIA_INDEX_NAME, ALGOLIA_SEARCH_API_KEY, ALGOLIA_APP_ID
 from .auth import token_required
@@ -18,7 +17,21 @@ from .pydantic_models import (
     UpdateSettingsRequest,
     ChallengeResponse
 )
-from .cache_utils import get_user_summary_cache_key, invalidate_user_summary_cache # <-- IMPORT cache helpers
+from dependencies import io_executor
+from .sanitization import is_valid_username
+from .cache_utils import (
+    get_user_summary_cache_key,
+    get_user_quickview_cache_key,
+    get_team_host_cache_key,
+    invalidate_user_summary_cache_async,
+    invalidate_user_quickview_cache,
+    invalidate_fcm_token_cache,
+    is_username_cached_as_taken,
+    mark_username_taken,
+    USER_SUMMARY_CACHE_TTL,
+    USER_QUICKVIEW_CACHE_TTL,
+    TEAM_HOST_CACHE_TTL
+)
 
 def get_user_profiles_from_ids(user_ids, current_user_id=None):
     """
@@ -28,26 +41,40 @@ def get_user_profiles_from_ids(user_ids, current_user_id=None):
     if not user_ids:
         return []
 
+    # Callers can pass the same id more than once (e.g. several teams with one host);
+    # look each up once and let the final ordering re-emit duplicates.
+    unique_ids = list(dict.fromkeys(user_ids))
+
     profiles_from_cache = {}
     ids_to_fetch_from_db = []
 
     redis_conn = redis_client()
     if redis_conn:
-        keys = [get_user_summary_cache_key(uid) for uid in user_ids]
+        keys = [get_user_summary_cache_key(uid) for uid in unique_ids]
         cached_results = redis_conn.mget(keys)
-        for user_id, cached_json in zip(user_ids, cached_results):
+        for user_id, cached_json in zip(unique_ids, cached_results):
             if cached_json:
-                model_data = json.loads(cached_json)
-                model_data.setdefault('rank', 0)
-                model_data.setdefault('currentStreak', 0)
-                model_data['docId'] = user_id
-                profiles_from_cache[user_id] = UserSummary.model_validate(model_data)
+                model_data = orjson.loads(cached_json)
+                # Cached entries are written below from already-typed fields,
+                # so rebuild them without running validation again.
+                profiles_from_cache[user_id] = UserSummary.model_construct(
+                    rank=0,
+                    userId=model_data['userId'],
+                    docId=user_id,
+                    displayName=model_data.get('displayName'),
+                    avatarUrl=model_data.get('avatarUrl'),
+                    currentStreak=model_data.get('currentStreak', 0),
+                    totalPoints=model_data.get('totalPoints', 0),
+                    isCurrentUser=False,
+                )
             else:
                 ids_to_fetch_from_db.append(user_id)
     else:
-        ids_to_fetch_from_db = user_ids
+        ids_to_fetch_from_db = unique_ids
 
-    profiles_from_db = []
+    # Database results are merged straight into the cache-hit map, so a fully
+    # cached lookup skips the Firestore block and goes straight to ordering.
+    all_profiles_map = profiles_from_cache
     if ids_to_fetch_from_db:
         refs = (db.collection('users').document(str(uid)) for uid in ids_to_fetch_from_db)
         docs = db.get_all(refs)
@@ -57,36 +84,95 @@ def get_user_profiles_from_ids(user_ids, current_user_id=None):
         for doc in docs:
             if doc.exists:
                 user = doc.to_dict()
-                entry = UserSummary(
-                    rank=0,
-                    userId=user.get('userId'),
-                    # --- THE FIX ---
-                    # The docId is the same as the userId.
-                    docId=user.get('userId'),
-                    displayName=user.get('displayName'),
-                    username=user.get('username'),
-                    avatarUrl=user.get('avatarUrl'),
-                    currentStreak=int(user.get('currentStreak', 0)),
-                    totalPoints=int(user.get('totalPoints', 0)),
-                )
-                profiles_from_db.append(entry)
+                cache_data = {
+                    'displayName': user.get('displayName'),
+                    'userId': user.get('userId'),
+                    'totalPoints': int(user.get('totalPoints', 0)),
+                    'currentStreak': int(user.get('currentStreak', 0)),
+                    'avatarUrl': user.get('avatarUrl'),
+                }
+                # Every field is coerced above, so skip pydantic's per-field validation.
+                # The docId is the same as the userId.
+                entry = UserSummary.model_construct(rank=0, docId=cache_data['userId'], isCurrentUser=False, **cache_data)
+                all_profiles_map[entry.userId] = entry
                 if pipe:
-                    key = get_user_summary_cache_key(user.get('userId'))
-                    cache_data = entry.model_dump(exclude={'rank', 'isCurrentUser', 'docId'})
-                    pipe.set(key, json.dumps(cache_data), ex=300)
+                    key = get_user_summary_cache_key(cache_data['userId'])
+                    pipe.set(key, orjson.dumps(cache_data), ex=USER_SUMMARY_CACHE_TTL)
         
         if pipe:
             pipe.execute()
 
-    all_profiles_map = {p.userId: p for p in list(profiles_from_cache.values()) + profiles_from_db}
-    
     if current_user_id and current_user_id in all_profiles_map:
         all_profiles_map[current_user_id].isCurrentUser = True
 
     return [all_profiles_map[uid] for uid in user_ids if uid in all_profiles_map]
 
+# Team challenge fields read to build an invitation
+_INVITATION_FIELDS = ['teamChallengeId', 'description', 'hostId']
+
+def get_team_invitations(invitation_ids):
+    """
+    Builds the pending team challenge invitations, resolving each host's display name.
+    When every team's hostId is already cached, the teams and their hosts are read
+    in a single Firestore batch instead of two dependent round-trips.
+    """
+    team_refs = [db.collection('teamChallenges').document(tid) for tid in invitation_ids]
+
+    redis_conn = redis_client()
+    cached_host_ids = redis_conn.mget([get_team_host_cache_key(tid) for tid in invitation_ids]) if redis_conn else []
+
+    if cached_host_ids and all(cached_host_ids):
+        host_refs = [db.collection('users').document(host_id) for host_id in set(cached_host_ids)]
+        team_data_list = []
+        host_profiles_map = {}
+        # The mask keeps the host reads to the one field needed, not the whole user doc
+        for doc in db.get_all(team_refs + host_refs, field_paths=_INVITATION_FIELDS + ['displayName']):
+            if not doc.exists:
+                continue
+            if doc.reference.parent.id == 'teamChallenges':
+                team_data_list.append(doc.to_dict())
+            else:
+                host_profiles_map[doc.id] = doc.to_dict().get('displayName')
+    else:
+        team_docs = [doc for doc in db.get_all(team_refs, field_paths=_INVITATION_FIELDS) if doc.exists]
+        team_data_list = [doc.to_dict() for doc in team_docs]
+
+        host_ids_to_fetch = {team_data.get('hostId') for team_data in team_data_list if team_data.get('hostId')}
+        if not host_ids_to_fetch:
+            return []
+
+        host_profiles_list = get_user_profiles_from_ids(list(host_ids_to_fetch))
+        host_profiles_map = {p.userId: p.displayName for p in host_profiles_list}
+
+        if redis_conn:
+            pipe = redis_conn.pipeline()
+            for doc, team_data in zip(team_docs, team_data_list):
+                if team_data.get('hostId'):
+                    pipe.set(get_team_host_cache_key(doc.id), team_data['hostId'], ex=TEAM_HOST_CACHE_TTL)
+            pipe.execute()
+
+    return [
+        TeamChallengeInvitation(
+            teamChallengeId=team_data.get('teamChallengeId'),
+            description=team_data.get('description'),
+            hostDisplayName=host_profiles_map.get(team_data.get('hostId'), "Someone")
+        )
+        for team_data in team_data_list
+    ]
+
 users_bp = Blueprint('users_bp', __name__)
 
+# The search-only credentials are fixed for the life of the process, so the
+# /search-key body is serialised once. Load these from environment variables for security.
+_ALGOLIA_SEARCH_KEY_BODY = AlgoliaSearchKeyResponse(
+    appId=ALGOLIA_APP_ID,
+    searchOnlyApiKey=ALGOLIA_SEARCH_API_KEY, # IMPORTANT: Generate this in your dashboard
+    indexName=ALGOLIA_INDEX_NAME
+).model_dump_json() if all([ALGOLIA_APP_ID, ALGOLIA_SEARCH_API_KEY, ALGOLIA_INDEX_NAME]) else None
+
+# Settings that change how a user is rendered in summaries
+_SUMMARY_SETTINGS = frozenset({'showDisplayNameInLeaderboard', 'showAvatarInLeaderboard'})
+
 @users_bp.route('/update-settings', methods=['POST'])
 @token_required
 def update_settings(user_id):
@@ -98,18 +184,8 @@ def update_settings(user_id):
     except Exception as e:
         return jsonify({"error": "Invalid request body", "details": str(e)}), 400
 
-    update_data = {}
-    # Dynamically build the dictionary of fields to update
-    if req_data.streakRemindersEnabled is not None:
-        update_data['streakRemindersEnabled'] = req_data.streakRemindersEnabled
-    if req_data.socialRemindersEnabled is not None:
-        update_data['socialRemindersEnabled'] = req_data.socialRemindersEnabled
-    if req_data.analysisRemindersEnabled is not None:
-        update_data['analysisRemindersEnabled'] = req_data.analysisRemindersEnabled
-    if req_data.showDisplayNameInLeaderboard is not None:
-        update_data['showDisplayNameInLeaderboard'] = req_data.showDisplayNameInLeaderboard
-    if req_data.showAvatarInLeaderboard is not None:
-        update_data['showAvatarInLeaderboard'] = req_data.showAvatarInLeaderboard
+    # Every UpdateSettingsRequest field is a setting; omitted ones stay None
+    update_data = req_data.model_dump(exclude_none=True)
 
     if not update_data:
         return jsonify({"message": "No settings to update"}), 200
@@ -117,10 +193,13 @@ def update_settings(user_id):
     try:
         user_ref = db.collection('users').document(user_id)
         user_ref.update(update_data)
+        # Reminder toggles are cached alongside the FCM token for notifications
+        if any(field.endswith('RemindersEnabled') for field in update_data):
+            invalidate_fcm_token_cache(user_id)
         
         # CRITICAL: Invalidate the cache after updating settings that might affect the user summary
-        if 'showDisplayNameInLeaderboard' in update_data or 'showAvatarInLeaderboard' in update_data:
-            invalidate_user_summary_cache(user_id)
+        if _SUMMARY_SETTINGS & update_data.keys():
+            invalidate_user_summary_cache_async(user_id)
             # You might also need to trigger an update to your Algolia index here
             # from tasks import update_algolia_record
             # update_algolia_record.delay(user_id)
@@ -134,31 +213,28 @@ def update_settings(user_id):
 @token_required
 def get_algolia_search_key(user_id):
     """Provides the client with a secure, search-only API key."""
-    # Load these from environment variables for security
-    app_id = ALGOLIA_APP_ID
-    search_only_key = ALGOLIA_SEARCH_API_KEY # IMPORTANT: Generate this in your dashboard
-    index_name = ALGOLIA_INDEX_NAME
-
-    if not all([app_id, search_only_key, index_name]):
+    if _ALGOLIA_SEARCH_KEY_BODY is None:
         logging.error("Algolia search-only credentials are not configured on the server.")
         return jsonify({"error": "Search is not configured."}), 503
 
-    response = AlgoliaSearchKeyResponse(
-        appId=app_id,
-        searchOnlyApiKey=search_only_key,
-        indexName=index_name
-    )
-    return response.model_dump(), 200
+    return Response(_ALGOLIA_SEARCH_KEY_BODY, mimetype='application/json', status=200)
 
 @users_bp.route('/check-username', methods=['POST'])
 @token_required
 def check_username(user_id):
     req_data = UsernameCheckRequest.model_validate(request.get_json())
-    users_ref = db.collection('users')
-    query = users_ref.where(filter=firestore.FieldFilter('username', '==', req_data.username)).limit(1)
-    docs = list(query.stream())
-    is_available = not docs
-    return jsonify({"available": is_available}), 200
+    # Claimed usernames are stored lowercased in the usernames collection (see onboarding)
+    username = req_data.username.lower().strip()
+    # Names onboarding would reject (or that aren't valid document ids) are never available
+    if not is_valid_username(username):
+        return jsonify({"available": False}), 200
+    # Redis answers known-taken names; a miss reads through to the usernames doc
+    if is_username_cached_as_taken(username):
+        return jsonify({"available": False}), 200
+    if db.collection('usernames').document(username).get(['userId']).exists:
+        mark_username_taken(username)
+        return jsonify({"available": False}), 200
+    return jsonify({"available": True}), 200
 
 @users_bp.route('/initiate-avatar-upload', methods=['POST'])
 @token_required
@@ -191,7 +267,7 @@ def avatar_upload_complete(user_id):
         return jsonify({"error": "gcsPath is required"}), 400
     
     # Invalidate the cache immediately for a responsive UI
-    invalidate_user_summary_cache(user_id)
+    invalidate_user_summary_cache_async(user_id)
     
     # Offload the heavy image processing to a Celery task
     process_avatar_image.delay(gcs_path, user_id)
@@ -213,28 +289,12 @@ def get_my_profile(user_id):
     # Debug logging to see what values are being read from Firestore
     logging.debug(f"Full profile for user {user_id}: onboardingComplete={user_data.get('onboardingComplete')}, onboardingStep={user_data.get('onboardingStep')}, hasCompletedTutorial={user_data.get('hasCompletedTutorial')}")
 
+    # The invitation lookup (teams, then their hosts) runs in the background
+    # while the latest challenges are fetched, so /me waits for the slower of
+    # the two chains instead of both.
     invitation_ids = user_data.get('teamChallengeInvitations', [])
-    invitations = []
-    if invitation_ids:
-        team_refs = [db.collection('teamChallenges').document(tid) for tid in invitation_ids]
-        team_docs = db.get_all(team_refs)
-        
-        host_ids_to_fetch = {doc.to_dict().get('hostId') for doc in team_docs if doc.exists and doc.to_dict().get('hostId')}
-        
-        if host_ids_to_fetch:
-            host_profiles_list = get_user_profiles_from_ids(list(host_ids_to_fetch))
-            host_profiles_map = {p.userId: p.displayName for p in host_profiles_list}
-
-            for doc in team_docs:
-                if doc.exists:
-                    team_data = doc.to_dict()
-                    host_id = team_data.get('hostId')
-                    invitations.append(TeamChallengeInvitation(
-                        teamChallengeId=team_data.get('teamChallengeId'),
-                        description=team_data.get('description'),
-                        hostDisplayName=host_profiles_map.get(host_id, "Someone")
-                    ))
-    
+    invitations_future = io_executor.submit(get_team_invitations, invitation_ids) if invitation_ids else None
+
     # Get latest completed challenges from user's completedChallengeIds
     latest_challenges = []
     try:
@@ -272,6 +332,8 @@ def get_my_profile(user_id):
                     latest_challenges.append(challenge_response)
     except Exception as e:
         logging.error(f"Error fetching latest challenges for user {user_id}: {str(e)}")
+
+    invitations = invitations_future.result() if invitations_future else []
     
     profile = ProfileResponse(
         userId=user_data.get("userId"),
@@ -297,7 +359,7 @@ def get_my_profile(user_id):
         hasCompletedTutorial=user_data.get("hasCompletedTutorial", False)
     )
     
-    return profile.model_dump(), 200
+    return Response(profile.model_dump_json(), mimetype='application/json', status=200)
 
 
 @users_bp.route('/<profile_user_id>/profile', methods=['GET'])
@@ -363,7 +425,7 @@ def get_public_profile(user_id, profile_user_id):
         latestChallenges=latest_challenges
     )
     
-    return public_profile.model_dump(), 200
+    return Response(public_profile.model_dump_json(), mimetype='application/json', status=200)
 
 @users_bp.route('/me/quickview', methods=['GET'])
 @token_required
@@ -372,6 +434,13 @@ def get_my_profile_quickview(user_id):
     A new, lightweight endpoint to get only the essential profile data
     needed for the main app UI, like the top bar stats.
     """
+    redis_conn = redis_client()
+    cache_key = get_user_quickview_cache_key(user_id)
+    if redis_conn:
+        cached_payload = redis_conn.get(cache_key)
+        if cached_payload:
+            return Response(cached_payload, mimetype='application/json', status=200)
+
     user_ref = db.collection('users').document(user_id)
     user_doc = user_ref.get(['totalPoints', 'currentStreak', 'maxStreak', 'onboardingComplete', 'onboardingStep', 'displayName', 'hasCompletedTutorial'])
 
@@ -384,7 +453,7 @@ def get_my_profile_quickview(user_id):
     logging.debug(f"QuickView for user {user_id}: onboardingComplete={user_data.get('onboardingComplete')}, onboardingStep={user_data.get('onboardingStep')}, hasCompletedTutorial={user_data.get('hasCompletedTutorial')}")
     
     # Return a minimal JSON object
-    return jsonify({
+    payload = orjson.dumps({
         "totalPoints": int(user_data.get("totalPoints", 0)),
         "currentStreak": user_data.get("currentStreak", 0),
         "maxStreak": user_data.get("maxStreak", 0),
@@ -392,7 +461,10 @@ def get_my_profile_quickview(user_id):
         "onboardingStep": user_data.get("onboardingStep", 0),
         "displayName": user_data.get("displayName"),
         "hasCompletedTutorial": user_data.get("hasCompletedTutorial", False)
-    }), 200
+    })
+    if redis_conn:
+        redis_conn.set(cache_key, payload, ex=USER_QUICKVIEW_CACHE_TTL)
+    return Response(payload, mimetype='application/json', status=200)
 
 
 @users_bp.route('/update-tutorial-status', methods=['POST'])
@@ -409,6 +481,7 @@ def update_tutorial_status(user_id):
         user_ref.update({
             'hasCompletedTutorial': has_completed_tutorial
         })
+        invalidate_user_quickview_cache(user_id)
         
         return jsonify({"message": "Tutorial status updated successfully"}), 200
     except Exception as e:
@@ -6,10 +6,12 @@ import uuid
 import argparse
 from google.cloud import firestore
 from google import genai
+from google.genai import types
 from google.oauth2 import service_account
 from firebase_init import initialize_firebase
 from dotenv import load_dotenv
-from api.prompts import CHALLENGE_GENERATION_PROMPT
+from api.prompts import build_challenge_generation_prompt
+from api.pydantic_models import ChallengeSpec
 import pytz
 import redis
 # --- SETUP & CONFIG ---
@@ -53,11 +55,16 @@ def generate_new_challenge_from_ai(timescale, challenge_type, previous_descripti
             client_instance = genai.Client(api_key=api_key)
         
             previous_list = "- " + "\n- ".join(previous_descriptions) if previous_descriptions else "N/A"
-            prompt = CHALLENGE_GENERATION_PROMPT.replace('{timescale_placeholder}', timescale)
-            prompt = prompt.replace('{challenge_type_placeholder}', challenge_type)
-            prompt = prompt.replace('{previous_challenges_placeholder}', previous_list)
+            prompt = build_challenge_generation_prompt(timescale, challenge_type, previous_list)
 
-            response = client_instance.models.generate_content(model="gemini-2.5-pro", contents=[prompt])
+            response = client_instance.models.generate_content(
+                model="gemini-2.5-pro",
+                contents=[prompt],
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json",
+                    response_schema=ChallengeSpec
+                ),
+            )
             
             logging.info(f"Successfully received response from Gemini API Key #{i + 1}.")
             raw_text = response.text
@@ -131,7 +138,7 @@ def generate_challenge_set(challenge_type, simple_count, progress_count):
         # Generate progress challenges
         for i in range(progress_count):
             challenge_data = generate_new_challenge_from_ai(challenge_type, 'progress', previous_descriptions)
-            if not all(k in challenge_data for k in ["description", "bonusPoints", "progressGoal"]):
+            if not all(k in challenge_data for k in ["description", "bonusPoints"]) or challenge_data.get("progressGoal") is None:
                 logging.warning(f"AI generated invalid progress data, skipping: {challenge_data}")
                 continue
             challenge_data.update({
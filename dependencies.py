@@ -6,6 +6,7 @@ to avoid circular imports and enable proper dependency injection.
 
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import firestore, storage, tasks_v2
 import redis
 from algoliasearch.search.client import SearchClientSync
@@ -20,6 +21,11 @@ db = firestore.Client()
 storage_client = storage.Client()
 tasks_client = tasks_v2.CloudTasksClient()
 
+# --- Shared I/O Thread Pool ---
+# For fanning out independent, blocking Firestore/gRPC calls within a request;
+# the GIL is released while they wait on the network.
+io_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='io')
+
 # --- Environment variables ---
 GCP_PROJECT_ID = os.environ.get("GCP_PROJECT_ID")
 GCP_QUEUE_ID = os.environ.get("GCP_QUEUE_ID")
@@ -1,5 +1,7 @@
 # FILE: trackeco-backend/extensions.py
 
+import orjson
+from flask.json.provider import DefaultJSONProvider
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
@@ -10,4 +12,18 @@ limiter = Limiter(
     storage_options={"decode_responses": True},
     # The default storage will be set in main.py from the environment variable.
     default_limits=["1000 per day", "300 per hour"] # A sensible default limit for most endpoints.
-)
\ No newline at end of file
+)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson. Output matches the default provider:
+    keys stay sorted, and dates are still handed to Flask's default() so they
+    keep the HTTP-date format clients already parse.
+    """
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
\ No newline at end of file
@@ -10,7 +10,7 @@ from pydantic import ValidationError
 from google.cloud import firestore
 from logging_config import setup_logging
 from celery_worker import celery_app
-from extensions import limiter  # <-- IMPORT the new limiter instance
+from extensions import limiter, ORJSONProvider  # <-- IMPORT the new limiter instance
 
 # --- SETUP & CONFIG ---
 # Load environment variables for the Flask app process.
@@ -21,6 +21,8 @@ setup_logging()
 initialize_firebase()
 
 app = Flask(__name__)
+# jsonify() and request.get_json() go through orjson
+app.json = ORJSONProvider(app)
 
 # --- Initialize Extensions ---
 # Set the Redis URL for the rate limiter from your environment variables.
@@ -50,7 +52,8 @@ app.register_blueprint(users_bp, url_prefix='/users')
 # --- Global Error Handlers ---
 @app.errorhandler(ValidationError)
 def handle_validation_error(e):
-    return jsonify({"error_code": "BAD_REQUEST", "details": e.errors()}), 400
+    # The raw input and validator ctx can hold bytes or exception objects, so both are left out of the details
+    return jsonify({"error_code": "BAD_REQUEST", "details": e.errors(include_input=False, include_context=False)}), 400
 
 @app.errorhandler(404)
 def resource_not_found(e):
@@ -4,7 +4,9 @@ import os
 import logging
 import time
 import datetime
+import functools
 import json
+import orjson
 from celery import Celery
 from google.cloud import storage, firestore
 from google import genai
@@ -15,12 +17,16 @@ from firebase_init import initialize_firebase
 import pytz
 import redis
 from logging_config import setup_logging
-from api.prompts import AI_ANALYSIS_PROMPT
+from api.prompts import PROMPT_VERSION, build_analysis_prompt
 from PIL import Image
 from io import BytesIO
 from api.cache_utils import invalidate_user_summary_cache # <-- IMPORT cache helper
 from api.search_utils import sync_user_to_algolia
+from api.notifications import send_notification
+from api.pydantic_models import AnalysisResult
+from api.llm_cache import make_verdict_key, get_cached_verdict, put_cached_verdict, delete_cached_verdict
 from google.genai import types
+from pydantic import ValidationError
 
 # --- SETUP & CONFIG ---
 setup_logging()
@@ -32,6 +38,8 @@ GEMINI_API_KEYS = [ os.environ.get(f"GEMINI_API_KEY_{i+1}") for i in range(4) ]
 ACTIVE_GEMINI_KEYS = [key for key in GEMINI_API_KEYS if key]
 GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME")
 WIB_TZ = pytz.timezone('Asia/Jakarta')
+GEMINI_ANALYSIS_MODEL = "gemini-2.5-pro"
+GEMINI_ANALYSIS_THINKING_BUDGET = 32768
 
 # --- LAZY INITIALIZED CLIENTS ---
 _db, _storage_client, _firebase_app, _redis_client = None, None, None, None
@@ -46,6 +54,15 @@ def get_redis_client():
 # Remove the local initialize_firebase function since we're using the centralized one
 
 # --- HELPER FUNCTIONS ---
+@functools.lru_cache(maxsize=8)
+def get_active_challenges_block(challenges):
+    """
+    Serializes the prompt's active-challenges block. `challenges` is a tuple of sorted
+    (field, value) item tuples, so every task in this worker that sees the same challenge
+    set reuses one serialization. Sorted fields also make the output canonical.
+    """
+    return orjson.dumps([dict(items) for items in challenges]).decode()
+
 def send_fcm_data_notification(doc_snapshot):
     """Sends a data-only FCM message with the document's current state."""
     try:
@@ -69,6 +86,22 @@ def sync_user_to_algolia_task(user_id):
     """Celery task to handle syncing a user to Algolia with retries."""
     sync_user_to_algolia(user_id)
 
+@celery_app.task(name="send_social_notification_task")
+def send_social_notification_task(actor_id, recipient_id, title, body_template, notification_type):
+    """Looks up the acting user's display name and sends a social notification to the recipient."""
+    from api.users import get_user_profiles_from_ids # Local import: api.users imports this module via api.auth
+    actor_profile = get_user_profiles_from_ids([actor_id])
+    if not actor_profile:
+        return
+    actor_name = actor_profile[0].displayName or "Someone"
+    send_notification(
+        user_id=recipient_id,
+        title=title,
+        body=body_template.format(name=actor_name),
+        data={"type": notification_type},
+        setting_name="socialRemindersEnabled"
+    )
+
 @celery_app.task(name="process_avatar_image")
 def process_avatar_image(gcs_path, user_id):
     logging.info(f"Processing avatar for user {user_id} from path: {gcs_path}")
@@ -126,7 +159,7 @@ def award_bonus_points(user_id, amount, reason):
 @firestore.transactional
 def update_stats_and_upload_transaction(transaction, user_ref, upload_ref, ai_result_json_string, active_challenges, today_wib_date):
     """Atomically updates user stats based on the new AI result format."""
-    ai_result = json.loads(ai_result_json_string)
+    ai_result = orjson.loads(ai_result_json_string)
     user_doc = user_ref.get(transaction=transaction)
     if not user_doc.exists:
         transaction.update(upload_ref, {'status': 'COMPLETED', 'aiResult': ai_result_json_string})
@@ -154,9 +187,10 @@ def update_stats_and_upload_transaction(transaction, user_ref, upload_ref, ai_re
             bonus_points += challenge.get('bonusPoints', 0)
             newly_completed_ids.append(challenge_id)
         
-        elif 'progress' in update and challenge.get('progressGoal') is not None:
+        # The response schema emits unused optional fields as null, so test the value rather than the key
+        elif update.get('progress') is not None and challenge.get('progressGoal') is not None:
             current_prog = challenge_progress.get(challenge_id, 0)
-            new_prog = current_prog + update.get('progress', 0)
+            new_prog = current_prog + update['progress']
             goal = challenge.get('progressGoal', 999)
             if new_prog >= goal:
                 bonus_points += challenge.get('bonusPoints', 0)
@@ -236,7 +270,7 @@ def handle_team_challenge_progress(user_id, ai_result):
     active_team_ids = user_doc.to_dict().get('activeTeamChallenges', [])
     if not active_team_ids: return
 
-    progress_updates_map = {p['challengeId']: p['progress'] for p in challenge_updates if 'progress' in p}
+    progress_updates_map = {p['challengeId']: p['progress'] for p in challenge_updates if p.get('progress') is not None}
     if not progress_updates_map: return
 
     for team_id in active_team_ids:
@@ -303,18 +337,22 @@ def analyze_video_with_gemini(self, bucket_name, gcs_filename, upload_id, user_i
         
         user_ref = db.collection('users').document(user_id)
         user_doc = user_ref.get()
-        user_completed_ids = user_doc.to_dict().get('completedChallengeIds', []) if user_doc.exists else []
+        user_completed_ids = set(user_doc.to_dict().get('completedChallengeIds', [])) if user_doc.exists else set()
         
         challenge_query = db.collection('challenges').where(filter=firestore.FieldFilter('isActive', '==', True))
         active_challenges_full = [doc.to_dict() for doc in challenge_query.stream()]
-        active_challenges_prompt = [c for c in active_challenges_full if c.get('challengeId') not in user_completed_ids]
         
-        for challenge in active_challenges_prompt:
+        for challenge in active_challenges_full:
             for key, value in list(challenge.items()):
                 if isinstance(value, datetime.datetime):
                     challenge[key] = value.isoformat() + "Z"
 
-        prompt = AI_ANALYSIS_PROMPT.replace('{active_challenges_placeholder}', json.dumps(active_challenges_prompt))
+        # The global block is identical for every user in a rotation window, keeping it in the
+        # shared prompt prefix; only the short list of the user's completed ids differs per user.
+        global_challenges_json = get_active_challenges_block(tuple(tuple(sorted(c.items())) for c in active_challenges_full))
+        completed_challenges_json = orjson.dumps(sorted(
+            c['challengeId'] for c in active_challenges_full if c.get('challengeId') in user_completed_ids
+        )).decode()
         
         if not source_blob.exists(): raise FileNotFoundError(f"Blob '{gcs_filename}' not found.")
         # Download file content once and reuse it to avoid multiple downloads
@@ -322,53 +360,70 @@ def analyze_video_with_gemini(self, bucket_name, gcs_filename, upload_id, user_i
         with open(temp_local_path, 'wb') as f:
             f.write(file_content)
         
-        analysis_result_str = None
         if not redis_client: raise ConnectionError("Cannot connect to Redis for API key management.")
-        start_index = int(redis_client.get("current_analysis_gemini_key_index") or 0)
-        
-        
-
-        for i in range(len(ACTIVE_GEMINI_KEYS)):
-            current_index = (start_index + i) % len(ACTIVE_GEMINI_KEYS)
-            api_key = ACTIVE_GEMINI_KEYS[current_index]
+        # Identical video + challenge pairs reuse the earlier verdict instead of calling Gemini again
+        verdict_key = make_verdict_key(
+            file_content, global_challenges_json + completed_challenges_json,
+            f"{GEMINI_ANALYSIS_MODEL}:thinking={GEMINI_ANALYSIS_THINKING_BUDGET}"
+        )
+        analysis_result_str = get_cached_verdict(verdict_key)
+        cached_verdict = None
+        if analysis_result_str:
             try:
-                logging.info(f"--> Trying Gemini API Key #{current_index + 1}")
-                client_instance = genai.Client(api_key=api_key)
+                cached_verdict = AnalysisResult.model_validate_json(analysis_result_str)
+                logging.info(f"Verdict cache hit for upload {upload_id}; skipping Gemini.")
+            except ValidationError as e:
+                # A verdict written under an older contract is a miss, not a failed upload
+                logging.warning(f"Discarding cached verdict for upload {upload_id} that fails the analysis schema: {e}")
+                delete_cached_verdict(verdict_key)
+                analysis_result_str = None
+        if not analysis_result_str:
+            start_index = int(redis_client.get("current_analysis_gemini_key_index") or 0)
+            for i in range(len(ACTIVE_GEMINI_KEYS)):
+                current_index = (start_index + i) % len(ACTIVE_GEMINI_KEYS)
+                api_key = ACTIVE_GEMINI_KEYS[current_index]
+                try:
+                    logging.info(f"--> Trying Gemini API Key #{current_index + 1}")
+                    client_instance = genai.Client(api_key=api_key)
                 
-                logging.info(f"Uploading file '{temp_local_path}' to Gemini File API...")
-                gemini_file_resource = client_instance.files.upload(file=temp_local_path)
+                    logging.info(f"Uploading file '{temp_local_path}' to Gemini File API...")
+                    gemini_file_resource = client_instance.files.upload(file=temp_local_path)
                 
-                while gemini_file_resource.state.name == "PROCESSING":
-                    time.sleep(10); gemini_file_resource = client_instance.files.get(name=gemini_file_resource.name)
+                    while gemini_file_resource.state.name == "PROCESSING":
+                        time.sleep(10); gemini_file_resource = client_instance.files.get(name=gemini_file_resource.name)
 
-                if gemini_file_resource.state.name == "FAILED":
-                    logging.error(f"Gemini file resource details: {gemini_file_resource}")
-                    raise Exception("Gemini File API processing failed.")
+                    if gemini_file_resource.state.name == "FAILED":
+                        logging.error(f"Gemini file resource details: {gemini_file_resource}")
+                        raise Exception("Gemini File API processing failed.")
                 
-                logging.info("File processed. Generating content...")
-                response = client_instance.models.generate_content(
-                    model="gemini-2.5-pro",
-                    contents=[prompt, gemini_file_resource],
-                    config=types.GenerateContentConfig(
-                        thinking_config=types.ThinkingConfig(thinking_budget=32768)
-                    ),
-                )
-                analysis_result_str = response.text
+                    logging.info(f"File processed. Generating content (prompt_version={PROMPT_VERSION})...")
+                    # The static prompt head comes first, so Gemini's implicit prefix caching can reuse it
+                    contents = [build_analysis_prompt(global_challenges_json, completed_challenges_json), gemini_file_resource]
+                    response = client_instance.models.generate_content(
+                        model=GEMINI_ANALYSIS_MODEL,
+                        contents=contents,
+                        config=types.GenerateContentConfig(
+                            response_mime_type="application/json",
+                            response_schema=AnalysisResult,
+                            thinking_config=types.ThinkingConfig(thinking_budget=GEMINI_ANALYSIS_THINKING_BUDGET)
+                        ),
+                    )
+                    analysis_result_str = response.text
                 
-                redis_client.set("current_analysis_gemini_key_index", current_index)
-                logging.info(f"Gemini API Key #{current_index + 1} succeeded. Setting as active key.")
-                break 
-            except Exception as e:
-                logging.warning(f"Gemini API Key #{current_index + 1} failed: {e}", exc_info=True)
-                if gemini_file_resource and client_instance:
-                    try: client_instance.files.delete(name=gemini_file_resource.name)
-                    except Exception as delete_error:
-                        logging.error(f"Failed to delete Gemini file resource: {delete_error}")
-                gemini_file_resource = None
-                if i == len(ACTIVE_GEMINI_KEYS) - 1:
-                    logging.error(f"All Gemini API keys failed for upload {upload_id}. Last error: {e}")
-                    raise
-                continue
+                    redis_client.set("current_analysis_gemini_key_index", current_index)
+                    logging.info(f"Gemini API Key #{current_index + 1} succeeded. Setting as active key.")
+                    break 
+                except Exception as e:
+                    logging.warning(f"Gemini API Key #{current_index + 1} failed: {e}", exc_info=True)
+                    if gemini_file_resource and client_instance:
+                        try: client_instance.files.delete(name=gemini_file_resource.name)
+                        except Exception as delete_error:
+                            logging.error(f"Failed to delete Gemini file resource: {delete_error}")
+                    gemini_file_resource = None
+                    if i == len(ACTIVE_GEMINI_KEYS) - 1:
+                        logging.error(f"All Gemini API keys failed for upload {upload_id}. Last error: {e}")
+                        raise
+                    continue
         
         if not analysis_result_str: raise Exception("All Gemini API keys failed.")
         # Log the raw Gemini response for debugging
@@ -392,33 +447,35 @@ def analyze_video_with_gemini(self, bucket_name, gcs_filename, upload_id, user_i
         
         # Parse the JSON with comprehensive error handling and fallbacks
         ai_result = None
-        parse_attempts = []
+        verdict = cached_verdict
+        parse_attempts = ["Validated verdict cache entry"] if cached_verdict else []
         
-        # Attempt 1: Parse the cleaned string directly
-        try:
-            ai_result = json.loads(cleaned_json_string)
-            parse_attempts.append("Direct parse of cleaned string")
-            logging.info(f"JSON parsing successful for upload {upload_id} (attempt 1)")
-        except json.JSONDecodeError as e:
-            parse_attempts.append(f"Direct parse failed: {e}")
+        # Attempt 1: Parse and validate the cleaned string in a single pass, without an intermediate dict
+        if verdict is None:
+            try:
+                verdict = AnalysisResult.model_validate_json(cleaned_json_string)
+                parse_attempts.append("Direct parse of cleaned string")
+                logging.info(f"JSON parsing successful for upload {upload_id} (attempt 1)")
+            except ValidationError as e:
+                parse_attempts.append(f"Direct parse failed: {e}")
         
         # Attempt 2: Try to find JSON object using regex if direct parse failed
-        if ai_result is None:
+        if verdict is None:
             try:
                 import re
                 # More robust regex pattern to find JSON objects
                 json_match = re.search(r'\{[\s\S]*\}', analysis_result_str)
                 if json_match:
                     potential_json = json_match.group(0)
-                    ai_result = json.loads(potential_json)
+                    ai_result = orjson.loads(potential_json)
                     cleaned_json_string = potential_json
                     parse_attempts.append("Regex extraction succeeded")
                     logging.info(f"JSON parsing successful via regex fallback for upload {upload_id}")
-            except (json.JSONDecodeError, AttributeError) as e:
+            except (orjson.JSONDecodeError, AttributeError) as e:
                 parse_attempts.append(f"Regex fallback failed: {e}")
         
         # Attempt 3: Try to fix common JSON formatting issues
-        if ai_result is None:
+        if verdict is None and ai_result is None:
             try:
                 # Handle cases where Gemini might return malformed JSON
                 fixed_json = cleaned_json_string
@@ -432,19 +489,31 @@ def analyze_video_with_gemini(self, bucket_name, gcs_filename, upload_id, user_i
                 if last_brace < len(fixed_json) - 1:
                     fixed_json = fixed_json[:last_brace + 1]
                 
-                ai_result = json.loads(fixed_json)
+                ai_result = orjson.loads(fixed_json)
                 cleaned_json_string = fixed_json
                 parse_attempts.append("Format fixing succeeded")
                 logging.info(f"JSON parsing successful via format fixing for upload {upload_id}")
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 parse_attempts.append(f"Format fixing failed: {e}")
         
-        if ai_result is None:
+        if verdict is None and ai_result is None:
             # All parsing attempts failed
             error_msg = f"All JSON parsing attempts failed for upload {upload_id}. Attempts: {parse_attempts}. Raw response (first 500 chars): {original_response[:500]}"
             logging.error(error_msg)
             raise ValueError(f"Could not parse AI response as JSON: {error_msg}")
         
+        # Responses recovered by the fallbacks still have to meet the contract before reaching the stats transaction
+        if verdict is None:
+            try:
+                verdict = AnalysisResult.model_validate(ai_result)
+            except ValidationError as e:
+                logging.error(f"AI response for upload {upload_id} does not match the analysis schema: {e}")
+                raise ValueError(f"AI response does not match the analysis schema: {e}")
+        ai_result = verdict.model_dump()
+        cleaned_json_string = verdict.model_dump_json()
+        
+        put_cached_verdict(verdict_key, ai_result, cleaned_json_string)
+        
         # Log successful parsing with detailed info
         logging.info(f"Successfully parsed JSON for upload {upload_id} via {parse_attempts[-1]}: {json.dumps({k: v for k, v in ai_result.items() if k not in ['challengeUpdates']})}")
         
@@ -485,7 +554,7 @@ def analyze_video_with_gemini(self, bucket_name, gcs_filename, upload_id, user_i
             ai_result["penaltyPoints"] = 0
             ai_result["challengeUpdates"] = []
             ai_result["suggestion"] = None
-            cleaned_json_string = json.dumps(ai_result)
+            cleaned_json_string = orjson.dumps(ai_result).decode()
         else:
             today_wib_date = datetime.datetime.now(WIB_TZ).date()
             transaction = db.transaction()
@@ -494,6 +563,8 @@ def analyze_video_with_gemini(self, bucket_name, gcs_filename, upload_id, user_i
             if referrer_id and is_first_upload:
                 award_bonus_points.delay(referrer_id, 50, "Successful Referral")
             
+            # Completed challenges are now visible to the model; never let them drive team progress
+            ai_result['challengeUpdates'] = [u for u in ai_result.get('challengeUpdates', []) if u.get('challengeId') not in user_completed_ids]
             handle_team_challenge_progress(user_id, ai_result)
         
         final_upload_doc = upload_ref.get()